@@ -0,0 +1,168 @@
+"""
+Cache Helper Functions
+
+Redis helper functions for caching serialized API responses.
+The client is created by ``connect()`` from the FastAPI lifespan. When
+REDIS_URL is not set caching is disabled and every helper is a no-op.
+Redis errors are logged and treated as a miss/no-op so requests fall back
+to MongoDB instead of failing.
+"""
+
+import functools
+import logging
+import os
+import secrets
+from dotenv import load_dotenv
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+# Load environment variables from .env file
+load_dotenv()
+
+redis = None
+
+redis_url = os.getenv("REDIS_URL")
+
+logger = logging.getLogger(__name__)
+
+EPOCH_KEY = "ver:epoch"
+
+# TTLs in seconds per cached collection
+HOSPITALS_TTL = 3600
+CLINICS_TTL = 300
+DOCTORS_TTL = 300
+AVAILABILITY_TTL = 60
+APPOINTMENTS_TTL = 60
+
+
+# HSET, then set the TTL only if the hash has none yet, in one atomic call.
+# Works on any Redis with scripting, unlike EXPIRE NX (Redis >= 7).
+_HSET_EXPIRE_NEW = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if redis.call('TTL', KEYS[1]) == -1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+"""
+_hset_expire_new = None
+
+# Read the collection version (creating the epoch if Redis lost it) and,
+# when a cache key is given, the body stored under "{version}:{variant}".
+_LOOKUP = """
+local epoch = redis.call('GET', KEYS[1])
+if not epoch then
+    redis.call('SET', KEYS[1], ARGV[1])
+    epoch = ARGV[1]
+end
+local version = epoch .. '.' .. (redis.call('GET', KEYS[2]) or '0')
+local body = false
+if KEYS[3] then
+    body = redis.call('HGET', KEYS[3], version .. ':' .. ARGV[2])
+end
+return {version, body}
+"""
+_lookup = None
+
+
+def connect():
+    """Create the Redis client on the running event loop"""
+    global redis, _hset_expire_new, _lookup
+    if redis_url:
+        redis = aioredis.from_url(redis_url)
+        _hset_expire_new = redis.register_script(_HSET_EXPIRE_NEW)
+        _lookup = redis.register_script(_LOOKUP)
+
+
+def _fail_open(func):
+    """Log Redis errors and return None instead of raising"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        except RedisError as e:
+            logger.warning("Redis %s failed: %s", func.__name__, e)
+            return None
+    return wrapper
+
+
+async def close():
+    """Close the Redis client"""
+    global redis
+    if redis is not None:
+        try:
+            await redis.aclose()
+        except RedisError as e:
+            logger.warning("Redis close failed: %s", e)
+    redis = None
+
+
+@_fail_open
+async def get(key: str):
+    """Return the cached bytes for key, or None on a miss"""
+    if redis is None:
+        return None
+    return await redis.get(key)
+
+
+@_fail_open
+async def set(key: str, ttl: int, value: bytes):
+    """Store value under key for ttl seconds"""
+    if redis is None:
+        return
+    await redis.setex(key, ttl, value)
+
+
+@_fail_open
+async def hset(key: str, field: str, ttl: int, value: bytes):
+    """Store one variant of key; the TTL applies to all variants together.
+
+    The TTL is only set when the hash is created, so writing later variants
+    never extends the lifetime of earlier ones.
+    """
+    if redis is None:
+        return
+    await _hset_expire_new(keys=[key], args=[field, value, ttl])
+
+
+@_fail_open
+async def delete(*keys: str):
+    """Invalidate the given keys"""
+    if redis is None or not keys:
+        return
+    await redis.delete(*keys)
+
+
+@_fail_open
+async def lookup(collection_name: str, key: str = None, variant: str = ""):
+    """Return ``(version, body)`` in one round-trip, or None when caching is disabled.
+
+    ``version`` is the collection's write version prefixed with a random
+    epoch stored in Redis. A flush or restart loses the epoch along with the
+    ``ver:*`` counters, so versions issued before it never match versions
+    issued after it. ``body`` is the variant cached under that version in the
+    hash ``key``, or None on a miss or when no key is given.
+    """
+    if redis is None:
+        return None
+    keys = [EPOCH_KEY, f"ver:{collection_name}"]
+    if key is not None:
+        keys.append(key)
+    version, body = await _lookup(keys=keys, args=[secrets.token_hex(8), variant])
+    return version.decode(), body
+
+
+@_fail_open
+async def bump_version(collection_name: str):
+    """Record a write so ETags issued for the collection stop matching"""
+    if redis is None:
+        return
+    await redis.incr(f"ver:{collection_name}")
+
+
+@_fail_open
+async def delete_matching(pattern: str):
+    """Invalidate every key matching a glob pattern"""
+    if redis is None:
+        return
+    keys = [key async for key in redis.scan_iter(match=pattern)]
+    if keys:
+        await redis.delete(*keys)
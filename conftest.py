@@ -0,0 +1 @@
+# Present so pytest puts the repo root on sys.path for the tests/ imports.
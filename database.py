@@ -3,10 +3,15 @@ Database Helper Functions
 
 MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
+
+The Motor client is created by ``connect()`` from the FastAPI lifespan so it
+binds to the running event loop; access the database as ``database.db``.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ConnectionFailure, OperationFailure
 from datetime import datetime, timezone
+import logging
 import os
 from dotenv import load_dotenv
 from typing import Union
@@ -15,18 +20,102 @@ from pydantic import BaseModel
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 _client = None
 db = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+# Connection pool and wire compression; zstd/snappy need MongoDB >= 4.2 and
+# the pymongo[zstd,snappy] extras, zlib is the always-available fallback.
+# MONGO_MAX_CONNECTIONS/MONGO_MIN_CONNECTIONS are a budget for the whole
+# server: every worker process opens its own pool, so they are split across
+# WEB_CONCURRENCY workers. Keep the max times the number of app hosts below
+# the cluster's connection limit (net.maxIncomingConnections or the Atlas
+# tier limit).
+_workers = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+client_options = {
+    "maxPoolSize": max(1, int(os.getenv("MONGO_MAX_CONNECTIONS", 200)) // _workers),
+    "minPoolSize": int(os.getenv("MONGO_MIN_CONNECTIONS", 10)) // _workers,
+    "compressors": os.getenv("MONGO_COMPRESSORS", "zstd,snappy,zlib"),
+    "zlibCompressionLevel": -1,
+    "retryWrites": True,
+}
+
+
+def connect():
+    """Create the Motor client on the running event loop"""
+    global _client, db
+    if database_url and database_name:
+        _client = AsyncIOMotorClient(database_url, **client_options)
+        db = _client[database_name]
+
+
+def close():
+    """Close the Motor client"""
+    global _client, db
+    if _client is not None:
+        _client.close()
+    _client = None
+    db = None
+
+async def ensure_indexes():
+    """Create the indexes the API relies on.
+
+    Failures are logged rather than raised so the app (and /healthz) still
+    starts when MongoDB is unreachable or existing data violates an index.
+    """
+    if db is None:
+        return
+    indexes = [
+        ("clinic", ["hospital_id"], {}),
+        ("doctor", [("clinic_id", 1), ("specialty", 1)], {}),
+        # A slot can only be booked once; enforced atomically by MongoDB. Its
+        # (doctor_id, date) prefix also serves the appointment list filters.
+        ("appointment", [("doctor_id", 1), ("date", 1), ("time_slot", 1)], {"unique": True}),
+    ]
+    for collection_name, keys, options in indexes:
+        try:
+            await db[collection_name].create_index(keys, **options)
+        except ConnectionFailure as e:
+            logger.error("Skipping index creation, MongoDB is unreachable: %s", e)
+            return
+        except OperationFailure as e:
+            hint = ""
+            if options.get("unique"):
+                hint = " Run `python database.py dedupe-appointments` to remove double bookings."
+            logger.error("Could not create index on %s %s: %s.%s", collection_name, keys, e, hint)
+
+async def remove_duplicate_appointments():
+    """Delete all but the earliest appointment per (doctor_id, date, time_slot).
+
+    Needed once before the unique slot index can be built on data written by
+    the old, racy duplicate check. Returns the number of deleted documents.
+    """
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    pipeline = [
+        {"$sort": {"_id": 1}},
+        {"$group": {
+            "_id": {"doctor_id": "$doctor_id", "date": "$date", "time_slot": "$time_slot"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    duplicate_ids = []
+    async for group in db.appointment.aggregate(pipeline, allowDiskUse=True):
+        duplicate_ids.extend(group["ids"][1:])
+    if not duplicate_ids:
+        return 0
+    result = await db.appointment.delete_many({"_id": {"$in": duplicate_ids}})
+    return result.deleted_count
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,10 +129,21 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def create_documents(collection_name: str, documents: list):
+    """Insert many documents with timestamps in a single round-trip"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    now = datetime.now(timezone.utc)
+    docs = [{**d, 'created_at': now, 'updated_at': now} for d in documents]
+
+    result = await db[collection_name].insert_many(docs)
+    return [str(_id) for _id in result.inserted_ids]
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -52,4 +152,68 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=limit)
+
+async def aggregate_documents(collection_name: str, pipeline: list, limit: int = None):
+    """Run an aggregation pipeline and return the resulting documents"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    return await db[collection_name].aggregate(pipeline).to_list(length=limit)
+
+def _list_pipeline(filter_dict: dict = None, skip: int = 0, limit: int = None, fields: tuple = None):
+    pipeline = [{"$match": filter_dict or {}}]
+    if limit:
+        # Stable order so skip/limit pages don't overlap
+        pipeline.append({"$sort": {"_id": 1}})
+    if skip:
+        pipeline.append({"$skip": skip})
+    if limit:
+        pipeline.append({"$limit": limit})
+    if fields is not None:
+        projection = {f: 1 for f in fields}
+        projection.update({"_id": 0, "id": {"$toString": "$_id"}})
+        pipeline.append({"$project": projection})
+    else:
+        pipeline.append({"$addFields": {"id": {"$toString": "$_id"}}})
+        pipeline.append({"$project": {"_id": 0}})
+    return pipeline
+
+async def list_documents(collection_name: str, filter_dict: dict = None, limit: int = None, skip: int = 0, fields: tuple = None):
+    """Get documents shaped for API responses, with ``_id`` renamed to a string ``id`` by MongoDB.
+
+    When ``fields`` is given only those fields (plus ``id``) are returned.
+    """
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    pipeline = _list_pipeline(filter_dict, skip, limit, fields)
+    return await db[collection_name].aggregate(pipeline).to_list(length=limit)
+
+async def iter_documents(collection_name: str, filter_dict: dict = None, batch_size: int = 1000):
+    """Yield API-shaped documents one at a time while the cursor fetches in batches"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    pipeline = _list_pipeline(filter_dict)
+    async for doc in db[collection_name].aggregate(pipeline, batchSize=batch_size):
+        yield doc
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+
+    async def _dedupe_appointments():
+        connect()
+        try:
+            deleted = await remove_duplicate_appointments()
+            print(f"Removed {deleted} duplicate appointment(s)")
+            await ensure_indexes()
+        finally:
+            close()
+
+    if sys.argv[1:] != ["dedupe-appointments"]:
+        sys.exit("usage: python database.py dedupe-appointments")
+    logging.basicConfig()
+    asyncio.run(_dedupe_appointments())
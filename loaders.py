@@ -0,0 +1,66 @@
+"""
+Batch Loaders
+
+Coalesce concurrent list lookups that filter on the same field. Keys requested
+within one event-loop tick are fetched together with a single ``$in`` query
+and each waiter receives only the documents for its own key.
+"""
+
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from database import list_documents
+from schemas import CLINIC_FIELDS, DOCTOR_FIELDS
+
+
+class BatchLoader:
+    """Batch ``{key_field: key}`` lookups on a collection into one query per tick"""
+
+    def __init__(self, collection_name: str, key_field: str, fields: Optional[tuple] = None):
+        self.collection_name = collection_name
+        self.key_field = key_field
+        # Projection applied to every batch; must include key_field
+        self.fields = fields
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._tasks = set()
+
+    def load(self, key: str) -> asyncio.Future:
+        """Return a future resolving to the documents whose key_field equals key"""
+        loop = asyncio.get_running_loop()
+        if not self._pending:
+            loop.call_soon(self._dispatch)
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append(future)
+        return future
+
+    def _dispatch(self):
+        pending, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._flush(pending))
+        # Keep a reference so the task isn't garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, pending: Dict[str, List[asyncio.Future]]):
+        try:
+            docs = await list_documents(
+                self.collection_name, {self.key_field: {"$in": list(pending)}}, fields=self.fields
+            )
+        except Exception as exc:
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(exc)
+            return
+
+        grouped = defaultdict(list)
+        for doc in docs:
+            grouped[doc.get(self.key_field)].append(doc)
+        for key, futures in pending.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(grouped.get(key, []))
+
+
+clinics_by_hospital = BatchLoader("clinic", "hospital_id", CLINIC_FIELDS)
+doctors_by_clinic = BatchLoader("doctor", "clinic_id", DOCTOR_FIELDS)
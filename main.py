@@ -1,13 +1,64 @@
+import asyncio
+import hashlib
 import os
-from fastapi import FastAPI, HTTPException
+import re
+import time
+from contextlib import asynccontextmanager
+import msgspec
+import orjson
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+import cache
+import database
+from loaders import clinics_by_hospital, doctors_by_clinic
+from schemas import APPOINTMENT_FIELDS, CLINIC_FIELDS, DOCTOR_FIELDS, HOSPITAL_FIELDS
+from database import (
+    aggregate_documents,
+    create_document,
+    create_documents,
+    get_documents,
+    iter_documents,
+    list_documents,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database.connect()
+    # Build indexes in the background so worker startup never waits on
+    # MongoDB server selection; keep a reference so the task isn't collected.
+    index_task = asyncio.create_task(database.ensure_indexes())
+    cache.connect()
+    yield
+    index_task.cancel()
+    await asyncio.gather(index_task, return_exceptions=True)
+    await cache.close()
+    database.close()
+
+
+def dumps(content) -> bytes:
+    """Serialize to UTF-8 JSON; ObjectIds and other unknown types become strings."""
+    return orjson.dumps(content, default=str)
 
-from database import db, create_document, get_documents
 
-app = FastAPI(title="Medical Booking API", version="1.0.0")
+class APIResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+app = FastAPI(
+    title="Medical Booking API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=APIResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,20 +74,163 @@ class IDModel(BaseModel):
     id: str
 
 
-def ensure_object_id(id_str: str) -> ObjectId:
-    try:
-        return ObjectId(id_str)
-    except Exception:
+_is_object_id = re.compile(r"[0-9a-fA-F]{24}").fullmatch
+
+
+def ensure_object_id(id_str: str) -> None:
+    """Validate the format only; callers needing the BSON value build ObjectId themselves."""
+    if not _is_object_id(id_str):
         raise HTTPException(status_code=400, detail="Invalid ID format")
 
 
+_msgspec_error = re.compile(r"(?P<msg>.*?)(?: - at `\$(?P<path>[^`]*)`)?", re.S).fullmatch
+_msgspec_path_part = re.compile(r"\.([^.\[]+)|\[(\d+)\]")
+_msgspec_missing_field = re.compile(r"Object missing required field `([^`]+)`").fullmatch
+
+
+def msgspec_errors(exc: msgspec.DecodeError) -> list:
+    """Translate a msgspec decode error into FastAPI's validation error list."""
+    if not isinstance(exc, msgspec.ValidationError):
+        return [{"type": "json_invalid", "loc": ["body"], "msg": "JSON decode error", "ctx": {"error": str(exc)}}]
+
+    match = _msgspec_error(str(exc))
+    loc = ["body"] + [
+        name if name else int(index)
+        for name, index in _msgspec_path_part.findall(match["path"] or "")
+    ]
+    missing = _msgspec_missing_field(match["msg"])
+    if missing:
+        return [{"type": "missing", "loc": loc + [missing[1]], "msg": "Field required"}]
+    return [{"type": "value_error", "loc": loc, "msg": match["msg"]}]
+
+
+def msgspec_body(struct_type):
+    """Dependency decoding the raw request body straight into a msgspec Struct.
+
+    This bypasses FastAPI's pydantic validation for hot POST payloads. Errors
+    are raised as RequestValidationError so clients get the usual 422 shape.
+    """
+    decoder = msgspec.json.Decoder(struct_type)
+
+    async def dependency(request: Request):
+        try:
+            return decoder.decode(await request.body())
+        except msgspec.DecodeError as e:
+            raise RequestValidationError(msgspec_errors(e))
+
+    return dependency
+
+
+def msgspec_openapi(struct_type) -> dict:
+    """OpenAPI requestBody and 422 response for a route whose body is read by msgspec_body."""
+    _, components = msgspec.json.schema_components((struct_type,))
+    schema = components[struct_type.__name__]
+    return {
+        "requestBody": {"required": True, "content": {"application/json": {"schema": schema}}},
+        "responses": {"422": {
+            "description": "Validation Error",
+            "content": {"application/json": {"schema": {"$ref": "#/components/schemas/HTTPValidationError"}}},
+        }},
+    }
+
+
+def parse_fields(fields: Optional[str], allowed: tuple) -> tuple:
+    """Turn a ?fields=a,b query value into a projection, defaulting to all allowed fields.
+
+    "id" is always returned, so ?fields=id yields an empty projection that
+    returns ids only.
+    """
+    if not fields:
+        return allowed
+    requested = {f.strip() for f in fields.split(",") if f.strip()} - {"id"}
+    unknown = requested.difference(allowed)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(f for f in allowed if f in requested)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+async def cached_list(
+    request: Request,
+    collection_name: str,
+    key: str,
+    variant: str,
+    ttl: Optional[int],
+    fetch: Callable[[], Awaitable[list]],
+) -> Response:
+    """Serve a list endpoint from Redis, falling back to fetch() on a miss.
+
+    The body is returned as ready-made JSON bytes so FastAPI skips
+    jsonable_encoder and response-model validation.
+
+    Variants of one query (e.g. different field projections) share a hash so a
+    single delete of key invalidates all of them. Pass ttl=None to skip caching.
+
+    The ETag combines the collection's write version with a hash of the query,
+    so a client whose If-None-Match still matches gets a 304 without touching
+    Redis data or MongoDB.
+    """
+    headers = {}
+    field = variant
+    # Version and cached body come back in a single Redis round-trip
+    cached = await cache.lookup(collection_name, key if ttl is not None else None, variant)
+    version, body = cached or (None, None)
+    if version is not None:
+        query_hash = hashlib.blake2b(f"{key}|{variant}".encode(), digest_size=8).hexdigest()
+        etag = f'"{version}:{query_hash}"'
+        headers["ETag"] = etag
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        # Bodies are stored under the version read above. A body fetched
+        # before a concurrent write lands under the old version and is never
+        # served with, or tagged as, the newer one.
+        field = f"{version}:{variant}"
+
+    if body is None:
+        items = await fetch()
+        body = dumps(items)
+        if ttl is not None:
+            await cache.hset(key, field, ttl, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.get("/")
 def read_root():
     return {"message": "Medical Booking Backend is running"}
 
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness probe; never touches the database."""
+    return {"ok": True}
+
+
+# Environment flags don't change while the process runs
+_DATABASE_URL_STATUS = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
+_DATABASE_NAME_STATUS = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
+
+# listCollections is a server round-trip; refresh it at most every 30s
+_COLLECTIONS_TTL = 30
+_cached_collections = {"t": 0.0, "data": None}
+
+
+async def _list_collections(db) -> list:
+    now = time.monotonic()
+    if _cached_collections["data"] is None or now - _cached_collections["t"] > _COLLECTIONS_TTL:
+        _cached_collections["data"] = await db.list_collection_names()
+        _cached_collections["t"] = now
+    return _cached_collections["data"]
+
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -47,6 +241,7 @@ def test_database():
     }
 
     try:
+        db = database.db
         if db is not None:
             response["database"] = "✅ Available"
             response["database_url"] = "✅ Configured"
@@ -54,7 +249,7 @@ def test_database():
             response["connection_status"] = "Connected"
 
             try:
-                collections = db.list_collection_names()
+                collections = await _list_collections(db)
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -65,8 +260,8 @@ def test_database():
     except Exception as e:
         response["database"] = f"❌ Error: {str(e)[:50]}"
 
-    response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-    response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
+    response["database_url"] = _DATABASE_URL_STATUS
+    response["database_name"] = _DATABASE_NAME_STATUS
 
     return response
 
@@ -74,65 +269,84 @@ def test_database():
 # Public endpoints for hospitals, clinics, doctors, appointments
 
 @app.get("/api/hospitals")
-def list_hospitals():
-    items = get_documents("hospital")
-    for it in items:
-        it["id"] = str(it.pop("_id"))
-    return items
+async def list_hospitals(request: Request, fields: Optional[str] = None):
+    proj = parse_fields(fields, HOSPITAL_FIELDS)
+    return await cached_list(
+        request, "hospital", "hospitals:all", ",".join(proj), cache.HOSPITALS_TTL,
+        lambda: list_documents("hospital", fields=proj),
+    )
 
 
-class HospitalCreate(BaseModel):
+class HospitalCreate(msgspec.Struct):
     name: str
     city: str
     address: str
     phone: Optional[str] = None
 
 
-@app.post("/api/hospitals", status_code=201)
-def create_hospital(payload: HospitalCreate):
-    hid = create_document("hospital", payload.model_dump())
+@app.post("/api/hospitals", status_code=201, openapi_extra=msgspec_openapi(HospitalCreate))
+async def create_hospital(payload: HospitalCreate = Depends(msgspec_body(HospitalCreate))):
+    hid = await create_document("hospital", msgspec.to_builtins(payload))
+    await cache.delete("hospitals:all")
+    await cache.bump_version("hospital")
     return {"id": hid}
 
 
 @app.get("/api/clinics")
-def list_clinics(hospital_id: Optional[str] = None):
-    filter_q = {}
-    if hospital_id:
-        filter_q = {"hospital_id": hospital_id}
-    items = get_documents("clinic", filter_q)
-    for it in items:
-        it["id"] = str(it.pop("_id"))
-    return items
+async def list_clinics(request: Request, hospital_id: Optional[str] = None, fields: Optional[str] = None):
+    proj = parse_fields(fields, CLINIC_FIELDS)
 
+    def fetch():
+        # Concurrent per-hospital lookups share one $in query
+        if hospital_id and proj == clinics_by_hospital.fields:
+            return clinics_by_hospital.load(hospital_id)
+        return list_documents("clinic", {"hospital_id": hospital_id} if hospital_id else {}, fields=proj)
 
-class ClinicCreate(BaseModel):
+    key = f"clinics:h={hospital_id or ''}"
+    return await cached_list(request, "clinic", key, ",".join(proj), cache.CLINICS_TTL, fetch)
+
+
+class ClinicCreate(msgspec.Struct):
     hospital_id: str
     name: str
     specialties: List[str] = []
 
 
-@app.post("/api/clinics", status_code=201)
-def create_clinic(payload: ClinicCreate):
+@app.post("/api/clinics", status_code=201, openapi_extra=msgspec_openapi(ClinicCreate))
+async def create_clinic(payload: ClinicCreate = Depends(msgspec_body(ClinicCreate))):
     # Validate hospital id format; existence check optional
     ensure_object_id(payload.hospital_id)
-    cid = create_document("clinic", payload.model_dump())
+    cid = await create_document("clinic", msgspec.to_builtins(payload))
+    await cache.delete("clinics:h=", f"clinics:h={payload.hospital_id}")
+    await cache.bump_version("clinic")
     return {"id": cid}
 
 
 @app.get("/api/doctors")
-def list_doctors(clinic_id: Optional[str] = None, specialty: Optional[str] = None):
+async def list_doctors(
+    request: Request,
+    clinic_id: Optional[str] = None,
+    specialty: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    proj = parse_fields(fields, DOCTOR_FIELDS)
     q = {}
     if clinic_id:
         q["clinic_id"] = clinic_id
     if specialty:
         q["specialty"] = specialty
-    items = get_documents("doctor", q)
-    for it in items:
-        it["id"] = str(it.pop("_id"))
-    return items
 
+    def fetch():
+        # Concurrent per-clinic lookups share one $in query
+        if clinic_id and not specialty and proj == doctors_by_clinic.fields:
+            return doctors_by_clinic.load(clinic_id)
+        return list_documents("doctor", q, fields=proj)
+
+    key = f"doctors:c={clinic_id or ''}:s={specialty or ''}"
+    return await cached_list(request, "doctor", key, ",".join(proj), cache.DOCTORS_TTL, fetch)
 
-class DoctorCreate(BaseModel):
+
+class DoctorCreate(msgspec.Struct):
     clinic_id: str
     name: str
     specialty: str
@@ -140,27 +354,101 @@ class DoctorCreate(BaseModel):
     time_slots: List[str] = []
 
 
-@app.post("/api/doctors", status_code=201)
-def create_doctor(payload: DoctorCreate):
+@app.post("/api/doctors", status_code=201, openapi_extra=msgspec_openapi(DoctorCreate))
+async def create_doctor(payload: DoctorCreate = Depends(msgspec_body(DoctorCreate))):
     ensure_object_id(payload.clinic_id)
-    did = create_document("doctor", payload.model_dump())
+    did = await create_document("doctor", msgspec.to_builtins(payload))
+    await cache.delete(
+        "doctors:c=:s=",
+        f"doctors:c={payload.clinic_id}:s=",
+        f"doctors:c=:s={payload.specialty}",
+        f"doctors:c={payload.clinic_id}:s={payload.specialty}",
+    )
+    await cache.bump_version("doctor")
     return {"id": did}
 
 
-@app.get("/api/appointments")
-def list_appointments(doctor_id: Optional[str] = None, date: Optional[str] = None):
+@app.get("/api/doctors/{doctor_id}/availability")
+async def doctor_availability(doctor_id: str, date: str):
+    """Free time slots for a doctor on a date, computed in a single aggregation."""
+    ensure_object_id(doctor_id)
+    key = f"availability:{doctor_id}:{date}"
+    body = await cache.get(key)
+    if body is None:
+        pipeline = [
+            {"$match": {"_id": ObjectId(doctor_id)}},
+            {"$lookup": {
+                "from": "appointment",
+                "let": {"d": {"$toString": "$_id"}},
+                "pipeline": [
+                    {"$match": {"$expr": {"$and": [
+                        {"$eq": ["$doctor_id", "$$d"]},
+                        {"$eq": ["$date", date]},
+                    ]}}},
+                    {"$project": {"_id": 0, "time_slot": 1}},
+                ],
+                "as": "booked",
+            }},
+            # $filter keeps the doctor's slot order, unlike $setDifference
+            {"$project": {"_id": 0, "free_slots": {"$filter": {
+                "input": {"$ifNull": ["$time_slots", []]},
+                "cond": {"$not": [{"$in": ["$$this", "$booked.time_slot"]}]},
+            }}}},
+        ]
+        docs = await aggregate_documents("doctor", pipeline, limit=1)
+        if not docs:
+            raise HTTPException(status_code=404, detail="Doctor not found")
+        body = dumps({"doctor_id": doctor_id, "date": date, "free_slots": docs[0]["free_slots"]})
+        await cache.set(key, cache.AVAILABILITY_TTL, body)
+    return Response(content=body, media_type="application/json")
+
+
+def _appointments_filter(doctor_id: Optional[str], date: Optional[str]) -> dict:
     q = {}
     if doctor_id:
         q["doctor_id"] = doctor_id
     if date:
         q["date"] = date
-    items = get_documents("appointment", q)
-    for it in items:
-        it["id"] = str(it.pop("_id"))
-    return items
+    return q
 
 
-class AppointmentCreate(BaseModel):
+@app.get("/api/appointments")
+async def list_appointments(
+    request: Request,
+    doctor_id: Optional[str] = None,
+    date: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    skip: int = Query(0, ge=0),
+    fields: Optional[str] = None,
+):
+    proj = parse_fields(fields, APPOINTMENT_FIELDS)
+    q = _appointments_filter(doctor_id, date)
+
+    def fetch():
+        return list_documents("appointment", q, limit=limit, skip=skip, fields=proj)
+
+    # Booking UIs poll one doctor's day; each page is a field of one hash
+    # so a new booking invalidates every page with a single delete. Other
+    # filters are not cached but still get an ETag.
+    ttl = cache.APPOINTMENTS_TTL if doctor_id and date else None
+    key = f"appointments:{doctor_id or ''}:{date or ''}"
+    variant = f"{skip}:{limit}:{','.join(proj)}"
+    return await cached_list(request, "appointment", key, variant, ttl, fetch)
+
+
+@app.get("/api/appointments/export")
+async def export_appointments(doctor_id: Optional[str] = None, date: Optional[str] = None):
+    """Stream every matching appointment as newline-delimited JSON."""
+    q = _appointments_filter(doctor_id, date)
+
+    async def lines():
+        async for doc in iter_documents("appointment", q):
+            yield dumps(doc) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+class AppointmentCreate(msgspec.Struct):
     patient_name: str
     patient_phone: str
     doctor_id: str
@@ -168,22 +456,21 @@ class AppointmentCreate(BaseModel):
     time_slot: str
 
 
-@app.post("/api/appointments", status_code=201)
-def create_appointment(payload: AppointmentCreate):
+@app.post("/api/appointments", status_code=201, openapi_extra=msgspec_openapi(AppointmentCreate))
+async def create_appointment(payload: AppointmentCreate = Depends(msgspec_body(AppointmentCreate))):
     ensure_object_id(payload.doctor_id)
-    # Basic duplicate check for same doctor/time
-    existing = get_documents("appointment", {
-        "doctor_id": payload.doctor_id,
-        "date": payload.date,
-        "time_slot": payload.time_slot
-    })
-    if existing:
+    # The unique (doctor_id, date, time_slot) index rejects double bookings
+    doc = msgspec.to_builtins(payload)
+    doc["status"] = "pending"
+    try:
+        aid = await create_document("appointment", doc)
+    except DuplicateKeyError:
         raise HTTPException(status_code=409, detail="This slot is already booked")
-
-    aid = create_document("appointment", {
-        **payload.model_dump(),
-        "status": "pending"
-    })
+    await cache.delete(
+        f"appointments:{payload.doctor_id}:{payload.date}",
+        f"availability:{payload.doctor_id}:{payload.date}",
+    )
+    await cache.bump_version("appointment")
     return {"id": aid, "status": "pending"}
 
 
@@ -196,26 +483,25 @@ class SeedResponse(BaseModel):
     doctors: int
 
 
-def _seed_dev_data() -> SeedResponse:
+async def _seed_dev_data() -> SeedResponse:
     """Insert a small set of sample hospitals, clinics, and doctors if empty."""
     # Only seed if there are no hospitals yet
-    existing_hospitals = get_documents("hospital")
+    existing_hospitals = await get_documents("hospital", limit=1)
     if existing_hospitals:
         return SeedResponse(hospitals=0, clinics=0, doctors=0)
 
-    # Hospitals
-    h_ids: List[str] = []
+    # Hospitals. Ids are generated client-side so the clinic and doctor
+    # inserts don't wait on each other and can be sent concurrently.
     demo_hospitals = [
         {"name": "مستشفى الشفاء", "city": "الرياض", "address": "حي العليا، شارع رقم 10", "phone": "+966500000001"},
         {"name": "مستشفى الندى", "city": "جدة", "address": "حي الروضة، طريق الملك", "phone": "+966500000002"},
         {"name": "مركز الرحمة الطبي", "city": "الدمام", "address": "حي المزروعية، شارع الأمير", "phone": "+966500000003"},
     ]
     for h in demo_hospitals:
-        h_id = create_document("hospital", h)
-        h_ids.append(h_id)
+        h["_id"] = ObjectId()
+    h_ids = [str(h["_id"]) for h in demo_hospitals]
 
     # Clinics per hospital
-    clinic_ids: List[str] = []
     demo_clinics = [
         (h_ids[0], [
             {"name": "قسم الباطنية", "specialties": ["باطنية", "سكري"]},
@@ -229,10 +515,10 @@ def _seed_dev_data() -> SeedResponse:
             {"name": "عيادة الأسنان", "specialties": ["أسنان"]},
         ]),
     ]
-    for hid, clinics in demo_clinics:
-        for c in clinics:
-            cid = create_document("clinic", {"hospital_id": hid, **c})
-            clinic_ids.append(cid)
+    all_clinics = [
+        {"_id": ObjectId(), "hospital_id": hid, **c} for hid, clinics in demo_clinics for c in clinics
+    ]
+    clinic_ids = [str(c["_id"]) for c in all_clinics]
 
     # Doctors per clinic
     demo_doctors = [
@@ -243,19 +529,35 @@ def _seed_dev_data() -> SeedResponse:
         {"clinic_id": clinic_ids[3], "name": "د. فهد السبيعي", "specialty": "عظام", "days_available": ["Tue","Wed"], "time_slots": ["09:00","09:30","10:00","10:30"]},
         {"clinic_id": clinic_ids[4], "name": "د. ليلى القحطاني", "specialty": "أسنان", "days_available": ["Sat","Thu"], "time_slots": ["09:00","09:30","10:00","10:30","11:00","11:30"]},
     ]
-    for d in demo_doctors:
-        create_document("doctor", d)
+    # Hospitals go first: they are what the emptiness check above looks at, so
+    # a failed clinic/doctor insert can never be repeated by a later seed.
+    await create_documents("hospital", demo_hospitals)
+    await asyncio.gather(
+        create_documents("clinic", all_clinics),
+        create_documents("doctor", demo_doctors),
+    )
 
     return SeedResponse(hospitals=len(h_ids), clinics=len(clinic_ids), doctors=len(demo_doctors))
 
 
 @app.post("/api/seed", response_model=SeedResponse)
-def seed_dev_data():
+async def seed_dev_data():
     """Seed the database with sample data. Safe to call multiple times."""
-    return _seed_dev_data()
+    result = await _seed_dev_data()
+    if result.hospitals:
+        for pattern in ("hospitals:*", "clinics:*", "doctors:*"):
+            await cache.delete_matching(pattern)
+        for collection_name in ("hospital", "clinic", "doctor"):
+            await cache.bump_version(collection_name)
+    return result
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Each worker process opens its own Mongo/Redis clients in the lifespan.
+    # "auto" picks uvloop/httptools when installed (uvloop isn't on Windows).
+    workers = int(os.getenv("WEB_CONCURRENCY", 2 * (os.cpu_count() or 1) + 1))
+    # Workers inherit this and size their Mongo pools from it
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers, loop="auto", http="auto")
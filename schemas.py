@@ -71,5 +71,13 @@ class Appointment(BaseModel):
     time_slot: str = Field(..., description="Selected time slot e.g., 10:30")
     status: str = Field("pending", description="Status: pending/confirmed/cancelled")
 
+# Fields returned by the list endpoints, in response order. Clients may
+# request a subset with ?fields=; "id" is always included.
+TIMESTAMP_FIELDS = ("created_at", "updated_at")
+HOSPITAL_FIELDS = tuple(Hospital.model_fields) + TIMESTAMP_FIELDS
+CLINIC_FIELDS = tuple(Clinic.model_fields) + TIMESTAMP_FIELDS
+DOCTOR_FIELDS = tuple(Doctor.model_fields) + TIMESTAMP_FIELDS
+APPOINTMENT_FIELDS = tuple(Appointment.model_fields) + TIMESTAMP_FIELDS
+
 # Note: The Flames database viewer can read these schemas from GET /schema endpoint
 # and help with ad-hoc CRUD if needed.
@@ -0,0 +1,46 @@
+import pytest
+from fastapi import HTTPException
+
+from database import _list_pipeline
+from main import _etag_matches, parse_fields
+from schemas import DOCTOR_FIELDS
+
+
+def test_parse_fields_defaults_to_all_fields():
+    assert parse_fields(None, DOCTOR_FIELDS) == DOCTOR_FIELDS
+    assert parse_fields("", DOCTOR_FIELDS) == DOCTOR_FIELDS
+
+
+def test_parse_fields_keeps_schema_order_and_drops_duplicates():
+    assert parse_fields(" specialty,name,name ", DOCTOR_FIELDS) == ("name", "specialty")
+
+
+@pytest.mark.parametrize("fields", ["id", ",", "id,"])
+def test_parse_fields_id_only_projects_just_the_id(fields):
+    proj = parse_fields(fields, DOCTOR_FIELDS)
+
+    assert proj == ()
+    assert _list_pipeline({}, fields=proj)[-1] == {
+        "$project": {"_id": 0, "id": {"$toString": "$_id"}}
+    }
+
+
+def test_parse_fields_rejects_unknown_fields():
+    with pytest.raises(HTTPException) as exc:
+        parse_fields("name,password", DOCTOR_FIELDS)
+
+    assert exc.value.status_code == 400
+    assert "password" in exc.value.detail
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    ('"abc.1:ff"', True),
+    ('W/"abc.1:ff"', True),
+    ('"other", "abc.1:ff"', True),
+    ('"abc.0:ff"', False),
+    ("*", True),
+])
+def test_etag_matches(header, expected):
+    assert _etag_matches(header, '"abc.1:ff"') is expected
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+import loaders
+from loaders import BatchLoader
+
+
+class FakeListDocuments:
+    """Stand-in for database.list_documents that records each query."""
+
+    def __init__(self, docs, error=None):
+        self.docs = docs
+        self.error = error
+        self.calls = []
+
+    async def __call__(self, collection_name, filter_dict=None, fields=None, **kwargs):
+        self.calls.append((collection_name, filter_dict, fields))
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        wanted = set(filter_dict["clinic_id"]["$in"])
+        return [d for d in self.docs if d["clinic_id"] in wanted]
+
+
+DOCS = [
+    {"id": "d1", "clinic_id": "c1"},
+    {"id": "d2", "clinic_id": "c1"},
+    {"id": "d3", "clinic_id": "c2"},
+    {"id": "d4", "clinic_id": "c3"},
+]
+
+
+def test_concurrent_loads_share_one_in_query(monkeypatch):
+    fake = FakeListDocuments(DOCS)
+    monkeypatch.setattr(loaders, "list_documents", fake)
+    loader = BatchLoader("doctor", "clinic_id", ("clinic_id", "name"))
+
+    async def run():
+        return await asyncio.gather(
+            loader.load("c1"), loader.load("c2"), loader.load("c1"), loader.load("missing")
+        )
+
+    c1, c2, c1_again, missing = asyncio.run(run())
+
+    assert len(fake.calls) == 1
+    collection_name, filter_dict, fields = fake.calls[0]
+    assert collection_name == "doctor"
+    assert sorted(filter_dict["clinic_id"]["$in"]) == ["c1", "c2", "missing"]
+    assert fields == ("clinic_id", "name")
+    assert [d["id"] for d in c1] == ["d1", "d2"]
+    assert c1_again == c1
+    assert [d["id"] for d in c2] == ["d3"]
+    assert missing == []
+
+
+def test_loads_in_separate_ticks_issue_separate_queries(monkeypatch):
+    fake = FakeListDocuments(DOCS)
+    monkeypatch.setattr(loaders, "list_documents", fake)
+    loader = BatchLoader("doctor", "clinic_id")
+
+    async def run():
+        first = await loader.load("c1")
+        second = await loader.load("c3")
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert len(fake.calls) == 2
+    assert [d["id"] for d in first] == ["d1", "d2"]
+    assert [d["id"] for d in second] == ["d4"]
+
+
+def test_query_error_is_raised_to_every_waiter(monkeypatch):
+    fake = FakeListDocuments(DOCS, error=RuntimeError("boom"))
+    monkeypatch.setattr(loaders, "list_documents", fake)
+    loader = BatchLoader("doctor", "clinic_id")
+
+    async def run():
+        return await asyncio.gather(loader.load("c1"), loader.load("c2"), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert len(fake.calls) == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_cancelled_waiter_does_not_affect_others(monkeypatch):
+    fake = FakeListDocuments(DOCS)
+    monkeypatch.setattr(loaders, "list_documents", fake)
+    loader = BatchLoader("doctor", "clinic_id")
+
+    async def run():
+        cancelled = asyncio.ensure_future(loader.load("c1"))
+        kept = asyncio.ensure_future(loader.load("c2"))
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        return await kept
+
+    kept = asyncio.run(run())
+
+    assert len(fake.calls) == 1
+    assert [d["id"] for d in kept] == ["d3"]
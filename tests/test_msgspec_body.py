@@ -0,0 +1,46 @@
+from typing import List
+
+import msgspec
+import pytest
+
+from main import msgspec_errors
+
+
+class Item(msgspec.Struct):
+    name: str
+    tags: List[str] = []
+
+
+class Payload(msgspec.Struct):
+    item: Item
+
+
+def errors_for(body: bytes) -> list:
+    with pytest.raises(msgspec.DecodeError) as exc:
+        msgspec.json.decode(body, type=Payload)
+    return msgspec_errors(exc.value)
+
+
+def test_wrong_type_maps_to_field_location():
+    assert errors_for(b'{"item": {"name": 1}}') == [
+        {"type": "value_error", "loc": ["body", "item", "name"], "msg": "Expected `str`, got `int`"}
+    ]
+
+
+def test_list_index_is_kept_as_int():
+    errors = errors_for(b'{"item": {"name": "x", "tags": ["a", 2]}}')
+    assert errors[0]["loc"] == ["body", "item", "tags", 1]
+
+
+@pytest.mark.parametrize("body, loc", [
+    (b"{}", ["body", "item"]),
+    (b'{"item": {}}', ["body", "item", "name"]),
+])
+def test_missing_field_matches_fastapi_shape(body, loc):
+    assert errors_for(body) == [{"type": "missing", "loc": loc, "msg": "Field required"}]
+
+
+def test_malformed_json():
+    (error,) = errors_for(b"{bad")
+    assert error["type"] == "json_invalid"
+    assert error["loc"] == ["body"]